@@ -2,17 +2,41 @@
 
 import logging
 import sys
-from typing import Any, Tuple
+from typing import Any, Mapping, Tuple
+
+_RESERVED_KEYS = frozenset(("exc_info", "extra", "stack_info"))
+
+
+def _to_key_vals(params: Mapping[str, Any]) -> str:
+    """
+    Render given params as space separated key="value" pairs
+
+    :param params: Mapping[str, Any]: params to render
+    :returns: str: rendered key-value pairs
+
+    """
+    return " ".join(f'{k}="{v}"' for (k, v) in params.items())
 
 
 class KeyValContextLogger(logging.LoggerAdapter):
     """
     Custom LoggerAdapter to inject context (e.g. correlation id) and to transform log as series of key-value pairs
+    NOTE: context is rendered once when `extra` is assigned, so replace `extra` rather than mutating it in place
     """
 
     def __init__(self, logger, **kwargs):
         super(KeyValContextLogger, self).__init__(logger, extra=kwargs)
 
+    @property
+    def extra(self) -> Mapping[str, Any]:
+        """Context injected into every log message"""
+        return self._extra
+
+    @extra.setter
+    def extra(self, value: Mapping[str, Any]) -> None:
+        self._extra = value
+        self._rendered_extra = _to_key_vals(value) if value else ""
+
     def process(self, message, kwargs) -> Tuple[str, dict[str, Any]]:
         """
         Override logging.LoggerAdapter.process to format the log message as key-values pairs
@@ -21,15 +45,31 @@ class KeyValContextLogger(logging.LoggerAdapter):
         :param kwargs: keyword arguments
         :returns: tuple of key-value formatted message and dict of reserved kwargs
         """
-        reserved_keys = ["exc_info", "extra", "stack_info"]
-        reserved_kwargs = {k: kwargs.pop(k) for k in reserved_keys if k in kwargs}
-        log_params = dict(event=message)
-        if isinstance(kwargs, dict):
-            log_params.update(kwargs)
-        log_params.update(self.extra)
-        kv_msg = " ".join([f'{k}="{v}"' for (k, v) in log_params.items()])
+        reserved_keys = _RESERVED_KEYS.intersection(kwargs)
+        reserved_kwargs = {k: kwargs.pop(k) for k in reserved_keys} if reserved_keys else {}
+        kv_msg = f'event="{message}"'
+        if kwargs:
+            kv_msg = f"{kv_msg} {_to_key_vals(kwargs)}"
+        if self._rendered_extra:
+            kv_msg = f"{kv_msg} {self._rendered_extra}"
         return kv_msg, reserved_kwargs
 
+    def log_template(self, level: int, template: str, *values: Any) -> None:
+        """
+        Log a message pre-rendered as key-value pairs with "{}" placeholders, skipping the generic key-value rendering.
+        Meant for frequent events, with templates built once, e.g. 'event="security not found" symbol="{}"'
+
+        :param level: int: logging level
+        :param template: str: key-value pairs of the message, with "{}" placeholder for each value
+        :param values: values to fill in the placeholders of template, in order
+
+        """
+        if self.isEnabledFor(level):
+            kv_msg = template.format(*values)
+            if self._rendered_extra:
+                kv_msg = f"{kv_msg} {self._rendered_extra}"
+            self.logger.log(level, kv_msg)
+
     def error(self, msg, *args, **kwargs) -> None:
         """
         Handle error and exception calls by examining sys.exc_info
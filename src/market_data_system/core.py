@@ -1,12 +1,20 @@
 """This module contains the class MarketDataService which implements core logic for Market Data System"""
 
-import uuid
-from collections import defaultdict
-from typing import Callable, DefaultDict, Dict, Optional, Set, TextIO
+import codecs
+import io
+import logging
+import secrets
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
 
-from market_data_system.entities import Config, Security, Subscription
+from market_data_system.entities import Config, Security, Subscription, TopicSubscriptions
 from market_data_system.helpers import convert_currency, get_configured_logger
 
+READ_CHUNK_SIZE = 64 * 1024
+# key-value templates of the logs emitted on the notification path, see KeyValContextLogger.log_template
+SECURITY_NOT_FOUND_LOG = 'event="security not found" symbol="{}"'
+CURRENCY_CONVERSION_LOG = ('event="currency conversion" source_currency="{}" source_rate="{}" source_value="{}" '
+                           'target_currency="{}" target_rate="{}" target_value="{}"')
+
 
 class MarketDataService:
     """
@@ -18,12 +26,22 @@ class MarketDataService:
         :in_stream: TextIO: text stream to read input commands from
         :out_stream: TextIO: text stream to write resulting output to
         :_base_currency: str: base currency used to express currency exchange rates
-        :_entitlements: Dict[str, Set[str]]: a mapping from user to set of symbols they are entitled to
+        :_entitlements: Dict[str, FrozenSet[str]]: a mapping from user to set of symbols they are entitled to
         :_securities: Dict[str, Security]: a mapping from symbol to Security instance it represents
-        :_active_subscriptions: Set[Subscription]: set of currently active subscriptions
-        :_subscriptions_by_topic: Dict[str, Dict[Subscription, None]]: a mapping from symbol to an ordered set of
-            subscriptions subscribing to its updates
+        :_active_subscriptions: Dict[Tuple[str, str, str], Subscription]: currently active subscriptions keyed by
+            (user, symbol, currency), so that they can be looked up without constructing a Subscription
+        :_subscriptions_by_topic: Dict[str, TopicSubscriptions]: a mapping from symbol to the subscriptions
+            subscribing to its updates, in creation order
+        :_topics_by_subscription: Dict[Subscription, List[str]]: a mapping from active subscription to the topics
+            it is linked to in _subscriptions_by_topic
+        :_formatted_prices: Dict[Tuple[str, str], Tuple[Tuple[Optional[float], ...], str]]: latest formatted
+            " <PRICE>" part of notifications keyed by (symbol, currency), along with the (price, source rate,
+            target rate) it was computed from, so that it is reused across ticks only while those stay the same
         :_processors: Dict[str, Callable[..., None]]: a mapping from command word to its respective processor method
+        :_valid_commands: Tuple[str, ...]: command words accepted by this service, as reported in error logs
+        :_pending_out: List[str]: messages published by the command being processed, not yet written to out_stream
+        :_debug_enabled: bool: whether DEBUG logs of this service are enabled, as of the latest command
+        :_info_enabled: bool: whether INFO logs of this service are enabled, as of the latest command
     """
 
     def __init__(self, config: Config, in_stream: TextIO, out_stream: TextIO):
@@ -36,6 +54,7 @@ class MarketDataService:
 
         """
         self.logger = get_configured_logger(self.__class__.__name__)
+        self._refresh_log_levels()
         self.in_stream = in_stream
         self.out_stream = out_stream
         self._base_currency = config.base_currency
@@ -43,51 +62,99 @@ class MarketDataService:
         self._securities = config.securities
         self._securities[self._base_currency] = Security(
             symbol=self._base_currency, currency=self._base_currency, price=1.0)
-        self._active_subscriptions: Set[Subscription] = set()
-        self._subscriptions_by_topic: DefaultDict[str, Dict[Subscription, None]] = defaultdict(dict)
+        self._active_subscriptions: Dict[Tuple[str, str, str], Subscription] = {}
+        self._subscriptions_by_topic: Dict[str, TopicSubscriptions] = {}
+        self._topics_by_subscription: Dict[Subscription, List[str]] = {}
+        self._formatted_prices: Dict[Tuple[str, str], Tuple[Tuple[Optional[float], ...], str]] = {}
         self._processors: Dict[str, Callable[..., None]] = {
             "tick": self.on_tick,
             "subscribe": self.on_subscribe,
             "unsubscribe": self.on_unsubscribe
         }
+        self._valid_commands: Tuple[str, ...] = tuple(self._processors)
+        self._pending_out: List[str] = []
 
     def run(self) -> None:
         """
-        Keep listening to input commands and process them in order `quit` command is received.
-        For each command, set a new UUID as correlation id into the log-context
+        Keep listening to input commands and process them in order until `quit` command is received or input ends.
+        For each command, set a new correlation id into the log-context: a random id generated once per run, followed
+        by the sequence number of the command in this run
 
         """
-        while True:
-            self.logger.extra = dict(correlation_id=str(uuid.uuid4()))
-            command = self.in_stream.readline().strip()
+        run_id = secrets.token_hex(8)
+        for sequence, command in enumerate(self._read_commands(), start=1):
+            self.logger.extra = dict(correlation_id=f"{run_id}-{sequence}")
             if command == "quit":
                 self.logger.info("CHECKPOINT: Exit", command=command)
                 break
             self.process_one(command)
+        else:
+            self.logger.info("CHECKPOINT: Exit on end of input")
+
+    def _read_commands(self) -> Iterator[str]:
+        """
+        Yield stripped input lines one by one.
+        If in_stream is backed by a binary buffer, read it in chunks of up to READ_CHUNK_SIZE bytes and split lines
+        from each chunk, so that a burst of commands costs one read instead of one per line.
+        Line endings "\n", "\r\n" and "\r" are all recognized, as with universal newlines of text streams.
+        NOTE: read1 returns whatever is available, so interactive input is still processed line by line
+
+        """
+        buffer = getattr(self.in_stream, "buffer", None)
+        if buffer is None or not hasattr(buffer, "read1"):
+            for line in self.in_stream:
+                yield line.strip()
+            return
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(self.in_stream.encoding)(self.in_stream.errors), translate=True)
+        pending = ""
+        while True:
+            chunk = buffer.read1(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+            for line in lines:
+                yield line.strip()
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending.strip()
 
     def process_one(self, command: str) -> None:
         """
-        Process a single command with error handling
+        Process a single command with error handling, then write everything it published to the output stream
 
         :param command: str: command to process
 
         """
+        self._refresh_log_levels()
         try:
             self.logger.info("CHECKPOINT: start processing command", command=command)
-            parts = command.split()
-            cmd, args = parts[0], parts[1:]
-            self._processors[cmd](*args)
-        except IndexError:
-            self.logger.warning("blank command", valid=list(self._processors.keys()), command=command)
-        except KeyError:
-            self.logger.error("unknown command", valid=list(self._processors.keys()), command=command)
+            words = command.split(None, 1)
+            cmd = words[0] if words else ""
+            processor = self._processors.get(cmd)
+            if processor is not None:
+                processor(*(words[1].split() if len(words) > 1 else ()))
+            elif not cmd:
+                self.logger.warning("blank command", valid=self._valid_commands, command=command)
+            else:
+                self.logger.error("unknown command", valid=self._valid_commands, command=command)
         except TypeError:
             self.logger.error("invalid args", command=command)
-        except ValueError:
+        except (KeyError, ValueError):
             self.logger.error("command failed", command=command)
         finally:
+            self._flush()
             self.logger.info("CHECKPOINT: end processing command", command=command)
 
+    def _refresh_log_levels(self) -> None:
+        """
+        Cache whether DEBUG and INFO logs are enabled, so that handlers can skip building log arguments otherwise.
+        Refreshed before every command, so level changes take effect from the next command
+
+        """
+        self._debug_enabled = self.logger.isEnabledFor(logging.DEBUG)
+        self._info_enabled = self.logger.isEnabledFor(logging.INFO)
+
     def on_tick(self, symbol: str, price: str) -> None:
         """
         Process `tick` command:
@@ -100,19 +167,31 @@ class MarketDataService:
 
         """
         try:
-            old_price = self._securities[symbol].price
-            new_price = float(price)
-            self._securities[symbol].price = new_price
-            self.logger.info("updated price by tick", symbol=symbol, old=old_price, new=new_price)
+            security = self._securities[symbol]
         except KeyError as e:
             raise ValueError(f"Unknown symbol: {symbol}") from e
-        subscriptions = self._subscriptions_by_topic.get(symbol, {})
-        self.logger.info("publishing tick update", symbol=symbol, subscription_count=len(subscriptions))
-        for cnt, subscription in enumerate(subscriptions, start=1):
-            message = self.get_market_notification(subscription=subscription)
-            self.publish(message)
-            self.logger.debug("published tick update", count=f"{cnt}/{len(subscriptions)}", content=message)
-        self.logger.info("published tick update", symbol=symbol, subscription_count=len(subscriptions))
+        old_price = security.price
+        security.price = float(price)
+        if self._info_enabled:
+            self.logger.info("updated price by tick", symbol=symbol, old=old_price, new=security.price)
+        topic_subscriptions = self._subscriptions_by_topic.get(symbol)
+        subscription_count = len(topic_subscriptions) if topic_subscriptions else 0
+        if self._info_enabled:
+            self.logger.info("publishing tick update", symbol=symbol, subscription_count=subscription_count)
+        # prices are fixed for the duration of this tick, so each (symbol, currency) pair is converted and formatted
+        # at most once and each currency rate is looked up at most once
+        price_texts: Dict[Tuple[str, str], str] = {}
+        rates: Dict[str, Optional[float]] = {}
+        get_market_notification = self.get_market_notification
+        publish = self.publish
+        if subscription_count:
+            for cnt, subscription in enumerate(topic_subscriptions.subscriptions, start=1):
+                message = get_market_notification(subscription, price_texts, rates)
+                publish(message)
+                if self._debug_enabled:
+                    self.logger.debug("published tick update", count=f"{cnt}/{subscription_count}", content=message)
+        if self._info_enabled:
+            self.logger.info("published tick update", symbol=symbol, subscription_count=subscription_count)
 
     def on_subscribe(self, user: str, symbol: str, currency: Optional[str] = None) -> None:
         """
@@ -128,9 +207,10 @@ class MarketDataService:
             to this subscription. Assume native currency of the symbol when currency is None
 
         """
-        user_entitlements = self._entitlements.get(user, {})
+        user_entitlements = self._entitlements.get(user, frozenset())
         if symbol not in user_entitlements:
-            self.logger.info("missing entitlement to security", user=user, symbol=symbol)
+            if self._info_enabled:
+                self.logger.info("missing entitlement to security", user=user, symbol=symbol)
             self.publish(f"User {user} is not entitled to {symbol}")
             return
 
@@ -138,31 +218,56 @@ class MarketDataService:
         subscription_currency = native_currency if currency is None else currency
 
         if subscription_currency != native_currency and subscription_currency not in user_entitlements:
-            self.logger.info("missing entitlement to dependent currency", user=user, symbol=subscription_currency)
+            if self._info_enabled:
+                self.logger.info("missing entitlement to dependent currency", user=user, symbol=subscription_currency)
             self.publish(f"User {user} is not entitled to {subscription_currency}")
             return
 
-        subscription = Subscription(user, symbol, subscription_currency)
-        if subscription in self._active_subscriptions:
-            self.logger.info("subscription already exists", subscription=f"{user} {symbol} {subscription_currency}")
+        key = (user, symbol, subscription_currency)
+        if key in self._active_subscriptions:
+            if self._info_enabled:
+                self.logger.info("subscription already exists",
+                                 subscription=f"{user} {symbol} {subscription_currency}")
             self.publish("Subscription already exists")
             return
 
-        self._active_subscriptions.add(subscription)
-        self.logger.debug("subscription created", subscription=f"{user} {symbol} {subscription_currency}")
+        subscription = self._active_subscriptions[key] = Subscription(user, symbol, subscription_currency)
+        if self._debug_enabled:
+            self.logger.debug("subscription created", subscription=subscription.prefix)
 
-        self._subscriptions_by_topic[subscription.symbol].setdefault(subscription)
-        self.logger.debug("subscribed to security", user=user, security=subscription.symbol)
+        topics = [subscription.symbol]
+        self._link(subscription.symbol, subscription)
+        if self._debug_enabled:
+            self.logger.debug("subscribed to security", user=user, security=subscription.symbol)
 
         if subscription.currency != native_currency:
-            self._subscriptions_by_topic[subscription.currency].setdefault(subscription)
-            self._subscriptions_by_topic[native_currency].setdefault(subscription)
-            self.logger.debug(
-                "subscription currency is not native currency of subscription security, subscribe to both",
-                user=user, security=symbol, native=native_currency, dependent=subscription_currency)
+            for topic in (subscription.currency, native_currency):
+                # a currency can be subscribed in another currency, e.g. GBP in EUR, and must be linked only once
+                if topic != subscription.symbol:
+                    topics.append(topic)
+                    self._link(topic, subscription)
+            if self._debug_enabled:
+                self.logger.debug(
+                    "subscription currency is not native currency of subscription security, subscribe to both",
+                    user=user, security=symbol, native=native_currency, dependent=subscription_currency)
+        self._topics_by_subscription[subscription] = topics
         notification = self.get_market_notification(subscription=subscription)
         self.publish(notification)
-        self.logger.info("published subscription update", content=notification)
+        if self._info_enabled:
+            self.logger.info("published subscription update", content=notification)
+
+    def _link(self, topic: str, subscription: Subscription) -> None:
+        """
+        Add given subscription to the subscriptions of given topic, creating them only if the topic has none yet
+
+        :param topic: str: topic (symbol) to link subscription to
+        :param subscription: Subscription: subscription to link
+
+        """
+        topic_subscriptions = self._subscriptions_by_topic.get(topic)
+        if topic_subscriptions is None:
+            topic_subscriptions = self._subscriptions_by_topic[topic] = TopicSubscriptions()
+        topic_subscriptions.add(subscription)
 
     def on_unsubscribe(self, user: str, symbol: str, currency: Optional[str] = None) -> None:
         """
@@ -178,49 +283,79 @@ class MarketDataService:
         security = self._securities[symbol]
         if currency is None:
             currency = security.currency
-            self.logger.debug("assume native currency of security since currency not provided",
-                              user=user, security=symbol, native=currency)
-        subscription = Subscription(user, symbol, currency)
-        if subscription in self._active_subscriptions:
-            for topic in [subscription.symbol, subscription.currency, security.currency]:
-                # pop from all possible topics. if link does not exist, then noop
-                # this simplifies implementation by avoiding checking native/non-native currencies
-                self._subscriptions_by_topic[topic].pop(subscription, None)
-                if len(self._subscriptions_by_topic[topic]) == 0:
+            if self._debug_enabled:
+                self.logger.debug("assume native currency of security since currency not provided",
+                                  user=user, security=symbol, native=currency)
+        subscription = self._active_subscriptions.pop((user, symbol, currency), None)
+        if subscription is not None:
+            topics = self._topics_by_subscription.pop(subscription, [])
+            for topic in topics:
+                topic_subscriptions = self._subscriptions_by_topic[topic]
+                topic_subscriptions.remove(subscription)
+                if not topic_subscriptions:
                     # if no subscriptions left in this topic, clean up
-                    self._subscriptions_by_topic.pop(topic)
-            self.logger.debug("unlinked subscription from relevant topics",
-                              subscription=f"{user} {symbol} {currency}",
-                              topics=f"[{subscription.symbol}, {subscription.currency}, {security.currency}]")
-            self._active_subscriptions.remove(subscription)
-            self.logger.info("removed subscription", subscription=f"{user} {symbol} {currency}")
+                    del self._subscriptions_by_topic[topic]
+            if self._debug_enabled:
+                self.logger.debug("unlinked subscription from relevant topics",
+                                  subscription=f"{user} {symbol} {currency}", topics=f"[{', '.join(topics)}]")
+            if self._info_enabled:
+                self.logger.info("removed subscription", subscription=f"{user} {symbol} {currency}")
         else:
             self.publish("Subscription does not exist")
-            self.logger.info("subscription does not exist", user=user, security=symbol, currency=currency)
-
-    def get_market_notification(self, subscription: Subscription) -> str:
+            if self._info_enabled:
+                self.logger.info("subscription does not exist", user=user, security=symbol, currency=currency)
+
+    def get_market_notification(
+            self,
+            subscription: Subscription,
+            price_texts: Optional[Dict[Tuple[str, str], str]] = None,
+            rates: Optional[Dict[str, Optional[float]]] = None
+    ) -> str:
         """
         Generate a notification to publish for given subscription, including price conversion, if any required
             - notification format: "<USER> <SYMBOL> <CURRENCY> <PRICE>"
             - USER, SYMBOL, CURRENCY : constituents of given subscription
             - PRICE : price of SYMBOL expressed in CURRENCY
+            - "<USER> <SYMBOL> <CURRENCY>" is precomputed as the prefix of subscription, and " <PRICE>" is shared by
+              all subscriptions to the same SYMBOL in the same CURRENCY, so it can be cached by caller
+            - " <PRICE>" is also reused from the previous computation for the same SYMBOL and CURRENCY, as long as the
+              price and currency rates it was computed from are unchanged
 
         :param subscription: Subscription: subscription to generate notification for
+        :param price_texts: Optional[Dict[Tuple[str, str], str]]:  (Default value = None) cache of formatted
+            " <PRICE>" parts keyed by (symbol, currency), valid only while prices stay unchanged (i.e. within a tick)
+        :param rates: Optional[Dict[str, Optional[float]]]:  (Default value = None) cache of currency rates, valid
+            under the same conditions as price_texts
 
         """
+        key = (subscription.symbol, subscription.currency)
+        if price_texts is not None and key in price_texts:
+            return subscription.prefix + price_texts[key]
+
         security = self._securities[subscription.symbol]
         price = security.price
-        if price is not None and security.currency != subscription.currency:
-            source_rate = self.get_price(security.currency)
-            target_rate = self.get_price(subscription.currency)
-            price = convert_currency(source_rate, target_rate, price)
-            self.logger.debug("currency conversion",
-                              source_currency=security.currency, source_rate=source_rate, source_value=security.price,
-                              target_currency=subscription.currency, target_rate=target_rate, target_value=price)
-        parts = [subscription.user, subscription.symbol, subscription.currency]
-        if price is not None:
-            parts.append(f"{price:.2f}")
-        return " ".join(parts)
+        converting = price is not None and security.currency != subscription.currency
+        if converting:
+            source_rate = self._get_rate(security.currency, rates)
+            target_rate = self._get_rate(subscription.currency, rates)
+        else:
+            source_rate = target_rate = None
+        inputs = (price, source_rate, target_rate)
+        formatted = self._formatted_prices.get(key)
+        # zeros are never reused, as 0.0 == -0.0 but they are formatted with different signs
+        if formatted is not None and formatted[0] == inputs and 0.0 not in inputs:
+            price_text = formatted[1]
+        else:
+            if converting:
+                price = convert_currency(source_rate, target_rate, price)
+                if self._debug_enabled:
+                    self.logger.log_template(logging.DEBUG, CURRENCY_CONVERSION_LOG, security.currency, source_rate,
+                                             security.price, subscription.currency, target_rate, price)
+            price_text = "" if price is None else f" {price:.2f}"
+            self._formatted_prices[key] = (inputs, price_text)
+        if price_texts is not None:
+            price_texts[key] = price_text
+        return subscription.prefix + price_text
 
     def get_price(self, symbol: str) -> Optional[float]:
         """
@@ -233,14 +368,38 @@ class MarketDataService:
         try:
             return self._securities[symbol].price
         except KeyError:
-            self.logger.debug("security not found", symbol=symbol)
+            self.logger.log_template(logging.DEBUG, SECURITY_NOT_FOUND_LOG, symbol)
             return None
 
+    def _get_rate(self, currency: str, rates: Optional[Dict[str, Optional[float]]]) -> Optional[float]:
+        """
+        Return latest price of given currency, looking it up only if it is not in given cache of rates yet
+
+        :param currency: str: currency to get price for
+        :param rates: Optional[Dict[str, Optional[float]]]: cache of currency rates, if any
+
+        """
+        if rates is None:
+            return self.get_price(currency)
+        if currency not in rates:
+            rates[currency] = self.get_price(currency)
+        return rates[currency]
+
     def publish(self, message: str):
         """
-        Write given message to the output stream of this service instance
+        Buffer given message for the output stream of this service instance.
+        Buffered messages are written by `_flush` once the current command is processed
 
         :param message: str: text to publish
 
         """
-        print(message, file=self.out_stream)
+        self._pending_out.append(message)
+
+    def _flush(self) -> None:
+        """
+        Write all buffered messages to the output stream with a single write, one message per line
+
+        """
+        if self._pending_out:
+            self.out_stream.write("\n".join(self._pending_out) + "\n")
+            self._pending_out.clear()
@@ -1,41 +1,112 @@
-"""This module contains entity-definitions that constitute the data and state of MarketDataService"""
+"""
+This module contains entity-definitions that constitute the data and state of MarketDataService
+NOTE: requires Python 3.10 or newer, as Security is a slotted dataclass
+"""
 
-from dataclasses import dataclass, field
-from typing import Dict, Optional, Set
+import sys
+from dataclasses import FrozenInstanceError, dataclass, field
+from typing import Dict, FrozenSet, NamedTuple, Optional
 
 BASE_CURRENCY = "USD"
 
 
-@dataclass(frozen=False)
+@dataclass(frozen=False, slots=True)
 class Security:
     """
     Security represents a market data series.
     It consists of symbol, its native currency, and latest price, if available
     This class is mutable as the price may keep changing.
+    It is slotted, as its price is read and written on every tick.
     """
     symbol: str
     currency: str
     price: Optional[float] = field(default=None)
 
+    __hash__ = None
+
 
-@dataclass(frozen=True, eq=True)
 class Subscription:
     """
     Subscription represents a unique subscription request.
     It consists of a user, symbol, and currency.
-    This class is immutable (hence hashable), and is intended to be used as lookup key
+    This class is immutable (hence hashable), and is intended to be used as lookup key.
+    Its strings are interned and its hash is computed once, as it is hashed and compared on every subscription lookup
+    Its notification prefix "<USER> <SYMBOL> <CURRENCY>" is also computed once, as it starts every notification
     """
-    user: str
-    symbol: str
-    currency: str
+    __slots__ = ("user", "symbol", "currency", "prefix", "_hash")
+
+    def __init__(self, user: str, symbol: str, currency: str):
+        object.__setattr__(self, "user", sys.intern(user))
+        object.__setattr__(self, "symbol", sys.intern(symbol))
+        object.__setattr__(self, "currency", sys.intern(currency))
+        object.__setattr__(self, "prefix", f"{self.user} {self.symbol} {self.currency}")
+        object.__setattr__(self, "_hash", hash((self.user, self.symbol, self.currency)))
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"cannot assign to field {name!r}")
+
+    def __delattr__(self, name):
+        raise FrozenInstanceError(f"cannot delete field {name!r}")
+
+    def __eq__(self, other):
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self._hash == other._hash and self.user == other.user and self.symbol == other.symbol
+                and self.currency == other.currency)
+
+    def __hash__(self):
+        return self._hash
+
+    def __reduce__(self):
+        return self.__class__, (self.user, self.symbol, self.currency)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(user={self.user!r}, symbol={self.symbol!r}, currency={self.currency!r})"
 
 
 @dataclass(frozen=False)
-class Config:
+class TopicSubscriptions:
+    """
+    TopicSubscriptions holds the subscriptions listening on one topic (symbol), in creation order.
+    Subscriptions are kept as keys of an insertion-ordered dict, so that publishing a tick walks them in creation order,
+    while membership checks, additions and removals all take constant time.
+    This class is mutable as subscriptions keep getting added and removed.
+    """
+    subscriptions: Dict[Subscription, None] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.subscriptions)
+
+    def __contains__(self, subscription: Subscription) -> bool:
+        return subscription in self.subscriptions
+
+    def add(self, subscription: Subscription) -> None:
+        """
+        Append given subscription, unless already present
+
+        :param subscription: Subscription: subscription to add
+
+        """
+        self.subscriptions.setdefault(subscription)
+
+    def remove(self, subscription: Subscription) -> None:
+        """
+        Remove given subscription, if present, preserving the order of the rest
+
+        :param subscription: Subscription: subscription to remove
+
+        """
+        self.subscriptions.pop(subscription, None)
+
+
+class Config(NamedTuple):
     """
     Config models initial config provided in terms of symbols, their currencies, and user entitlements.
     Additionally, it defines a base currency which is used to express all currency exchange rates.
+    It is a lightweight record: its fields cannot be reassigned, but the mappings they hold are not copied.
+    NOTE: MarketDataService adds its base currency to securities and updates their prices in place, so services
+    created from the same Config share, and change, the same securities
     """
     securities: Dict[str, Security]
-    entitlements: Dict[str, Set[str]]
-    base_currency: str = field(default=BASE_CURRENCY)
+    entitlements: Dict[str, FrozenSet[str]]
+    base_currency: str = BASE_CURRENCY
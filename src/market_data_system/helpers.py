@@ -1,19 +1,26 @@
 """This module holds helper functions for Market Data System"""
 
+import functools
 import json
 import logging
 import logging.config
-from typing import Optional
+import sys
+from typing import Any, Dict, Optional
 
 from common.logging_adapter import KeyValContextLogger
 from market_data_system.entities import Config, Security
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def convert_currency(
         source_rate: Optional[float],
         target_rate: Optional[float],
         source_value: Optional[float],
-        precision=2
+        precision: Optional[int] = None
 ) -> Optional[float]:
     """
     Convert from source currency to target currency given conversion rates for both w.r.t. a common base currency
@@ -21,35 +28,76 @@ def convert_currency(
     :param source_rate: Optional[float]: rate of source currency w.r.t. common base currency
     :param target_rate: Optional[float]: rate of target currency w.r.t. common base currency
     :param source_value: Optional[float]: value in source currency
-    :param precision:  (Default value = 2) rounding precision
+    :param precision: Optional[int]:  (Default value = None) rounding precision. No rounding if None, e.g. when the
+        value is only going to be formatted with fixed decimals, which rounds it anyway
     :returns: Optional[float]: equivalent value in target currency if all params are non-null else None
 
     """
-    if any(val is None for val in [source_rate, target_rate, source_value]):
+    if source_rate is None or target_rate is None or source_value is None:
         return None
-    return round((source_value * source_rate / target_rate), precision)
+    target_value = source_value * source_rate / target_rate
+    return target_value if precision is None else round(target_value, precision)
+
+
+def _read_json(path: str) -> Any:
+    """
+    Read and parse given JSON file in one shot, using orjson if it is installed, else the standard json module
+
+    :param path: str: path to JSON file
+    :returns: Any: parsed JSON
+
+    """
+    with open(path, "rb") as fp:
+        data = fp.read()
+    return json.loads(data) if orjson is None else orjson.loads(data)
 
 
 def load_market_data_system_config(config_path: str) -> Config:
     """
-    Load config for market data system from given JSON file
+    Load config for market data system from given JSON file.
+    All symbols, currencies and users are interned, so that the same strings in subscriptions and lookups made later
+    compare by identity
 
     :param config_path: str: path to config JSON file
     :returns: Instance of Config
 
     """
-    with open(config_path, encoding='utf-8') as fp:
-        config_json = json.load(fp)
+    config_json = _read_json(config_path)
     securities = {}
     entitlements = {}
     for symbol, currency_obj in config_json["symbols"].items():
-        currency = currency_obj["currency"]
+        symbol = sys.intern(symbol)
+        currency = sys.intern(currency_obj["currency"])
         securities[symbol] = Security(symbol=symbol, currency=currency)
     for user, symbols in config_json["users"].items():
-        entitlements[user] = set(symbols)
+        entitlements[sys.intern(user)] = frozenset(sys.intern(symbol) for symbol in symbols)
     return Config(securities=securities, entitlements=entitlements)
 
 
+@functools.lru_cache(maxsize=1)
+def _load_logging_config(config_path: str) -> Dict[str, Any]:
+    """
+    Load logging dict config from given JSON file. Cached, so repeated loads of the same file skip parsing
+
+    :param config_path: str: path to JSON file containing dict config
+    :returns: Dict[str, Any]: logging dict config
+
+    """
+    return _read_json(config_path)
+
+
+@functools.lru_cache(maxsize=1)
+def _apply_logging_config(config_path: str) -> None:
+    """
+    Apply logging dict config from given JSON file.
+    Cached, so it is applied again only if another config file was applied in between
+
+    :param config_path: str: path to JSON file containing dict config
+
+    """
+    logging.config.dictConfig(_load_logging_config(config_path))
+
+
 def get_configured_logger(name: str, config_path: str = "config/logging_dict_config.json") -> KeyValContextLogger:
     """
     Create a KeyValContextLogger instance using given logger if configured in dict config JSON file
@@ -60,9 +108,8 @@ def get_configured_logger(name: str, config_path: str = "config/logging_dict_con
     :raises: ValueError: if given logger name is not configured in logging dict config
 
     """
-    with open(config_path, encoding='utf-8') as fp:
-        config_json = json.load(fp)
+    config_json = _load_logging_config(config_path)
     if name not in config_json["loggers"]:
         raise ValueError(f"Logger not configured in {config_path}: {name}")
-    logging.config.dictConfig(config_json)
+    _apply_logging_config(config_path)
     return KeyValContextLogger(logger=logging.getLogger(name))
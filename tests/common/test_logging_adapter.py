@@ -1,3 +1,4 @@
+import logging
 
 
 def test_simple_log(log_stream, string_logger):
@@ -9,6 +10,36 @@ def test_simple_log(log_stream, string_logger):
     assert log_stream.getvalue() == expected
 
 
+def test_log_context_replaced(log_stream, string_logger):
+    log_stream.truncate(0)
+    log_stream.seek(0)
+    string_logger.extra = {"context_id": 1234}
+    string_logger.info("log 1")
+    string_logger.extra = {"context_id": 5678, "stage": "end"}
+    string_logger.info("log 2", key=2)
+    string_logger.extra = dict()
+    string_logger.info("log 3")
+    assert log_stream.getvalue() == ('level=INFO logger=string_logger event="log 1" context_id="1234"\n'
+                                     'level=INFO logger=string_logger event="log 2" key="2" context_id="5678" '
+                                     'stage="end"\n'
+                                     'level=INFO logger=string_logger event="log 3"\n')
+
+
+def test_log_template(log_stream, string_logger):
+    log_stream.truncate(0)
+    log_stream.seek(0)
+    string_logger.extra = {"context_id": 1234}
+    string_logger.log_template(logging.INFO, 'event="log 1" key="{}" other="{}"', 2, None)
+    string_logger.info("log 1", key=2, other=None)
+    string_logger.extra = dict()
+    string_logger.log_template(logging.INFO, 'event="log 2" key="{}"', 3)
+    string_logger.logger.setLevel(logging.INFO)
+    string_logger.log_template(logging.DEBUG, 'event="log 3"')
+    assert log_stream.getvalue() == ('level=INFO logger=string_logger event="log 1" key="2" other="None" '
+                                     'context_id="1234"\n' * 2 +
+                                     'level=INFO logger=string_logger event="log 2" key="3"\n')
+
+
 def test_error_log(log_stream, string_logger):
     log_stream.truncate(0)
     log_stream.seek(0)
@@ -29,3 +60,9 @@ def test_error_log(log_stream, string_logger):
     assert '\nKeyError: \'inner error\'\n' in actual
     assert '\nValueError: outer error\n' in actual
 
+
+def test_process_reserved_kwargs(string_logger):
+    string_logger.extra = dict()
+    assert string_logger.process("log 1", {"key": 2}) == ('event="log 1" key="2"', {})
+    assert string_logger.process("log 2", {"key": 2, "stack_info": True, "exc_info": False}) == \
+           ('event="log 2" key="2"', {"stack_info": True, "exc_info": False})
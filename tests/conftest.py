@@ -15,6 +15,16 @@ sys.path.insert(0, os.path.abspath('src'))
 # I'd preferably solve this by adding src/ to PYTHONPATH, or changing run command to python3 -m src.app data/config.json
 
 
+@pytest.fixture(autouse=True)
+def clear_logging_config_cache():
+    from market_data_system import helpers
+    helpers._load_logging_config.cache_clear()
+    helpers._apply_logging_config.cache_clear()
+    yield
+    helpers._load_logging_config.cache_clear()
+    helpers._apply_logging_config.cache_clear()
+
+
 @pytest.fixture
 def log_stream():
     return StringIO("")
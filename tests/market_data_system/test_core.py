@@ -1,11 +1,19 @@
-from collections import defaultdict
-from io import StringIO
+import logging
+from io import BufferedReader, BytesIO, StringIO, TextIOWrapper
 
 import pytest
 from pytest_mock import MockFixture
 
 from market_data_system.core import MarketDataService
-from market_data_system.entities import Config, Security, Subscription
+from market_data_system.entities import Config, Security, Subscription, TopicSubscriptions
+from market_data_system.helpers import convert_currency
+
+
+def topic_of(*subscriptions: Subscription) -> TopicSubscriptions:
+    topic_subscriptions = TopicSubscriptions()
+    for sub in subscriptions:
+        topic_subscriptions.add(sub)
+    return topic_subscriptions
 
 
 @pytest.fixture
@@ -48,21 +56,32 @@ def subscriptions_fixture():
 
 
 def test_run(service_fixture, ips, ops, log_stream, mocker: MockFixture):
-    mock_uuid = mocker.patch("market_data_system.core.uuid.uuid4", side_effect=["u1", "u2", "u3"])
-    mock_uuid.side_effect = ["u1", "u2", "u3"]
+    mock_token = mocker.patch("market_data_system.core.secrets.token_hex", return_value="r1")
     mock_process_one = mocker.patch("market_data_system.core.MarketDataService.process_one")
     ips.write("cmd1\ncmd2\nquit\n")
     ips.seek(0)
     service_fixture.run()
     assert mock_process_one.call_count == 2
+    assert mock_token.call_count == 1
     assert log_stream.getvalue() == ('level=INFO logger=string_logger event="CHECKPOINT: Exit" command="quit" '
-                                     'correlation_id="u3"\n')
+                                     'correlation_id="r1-3"\n')
+
+
+def test_run_reads_buffered_input_until_end(service_fixture, mocker: MockFixture):
+    mock_process_one = mocker.patch("market_data_system.core.MarketDataService.process_one")
+    mocker.patch("market_data_system.core.READ_CHUNK_SIZE", 4)
+    raw = BytesIO("tick SYM 1.5\r\nsubscribe usér SYM\n\ntick A 1\rtick B 2\r\rtick SYM 2".encode("utf-8"))
+    service_fixture.in_stream = TextIOWrapper(BufferedReader(raw), encoding="utf-8")
+    service_fixture.run()
+    assert [c[0][0] for c in mock_process_one.call_args_list] == [
+        "tick SYM 1.5", "subscribe usér SYM", "", "tick A 1", "tick B 2", "", "tick SYM 2"]
 
 
 def test_process_one(service_fixture, mocker: MockFixture):
     mock_proc = {
         "invalid_args": mocker.MagicMock(return_value=TypeError("args invalid")),
         "failure": mocker.MagicMock(return_value=ValueError("command failed")),
+        "lookup_failure": mocker.MagicMock(side_effect=KeyError("SYM")),
         "success": mocker.MagicMock(return_value=None)
     }
     mocker.patch.object(service_fixture, "_processors", mock_proc)
@@ -70,17 +89,51 @@ def test_process_one(service_fixture, mocker: MockFixture):
     service_fixture.process_one("unknown 1 2")
     service_fixture.process_one("invalid_args 1 2 3")
     service_fixture.process_one("failure 1 ")
+    service_fixture.process_one("lookup_failure  SYM")
     service_fixture.process_one("success 1 2")
+    service_fixture.process_one("successful 1 2")
+    service_fixture.process_one("s 1 2")
+    service_fixture.process_one("success\t3")
+    service_fixture.process_one("  success 4 ")
     assert mock_proc["invalid_args"].call_count == 1
     assert mock_proc["invalid_args"].call_args[0] == ("1", "2", "3")
     assert mock_proc["failure"].call_count == 1
     assert mock_proc["failure"].call_args[0] == ("1",)
-    assert mock_proc["success"].call_count == 1
-    assert mock_proc["success"].call_args[0] == ("1", "2")
+    assert mock_proc["lookup_failure"].call_count == 1
+    assert mock_proc["lookup_failure"].call_args[0] == ("SYM",)
+    assert mock_proc["success"].call_count == 3
+    assert [c[0] for c in mock_proc["success"].call_args_list] == [("1", "2"), ("3",), ("4",)]
+
+
+def test_process_one_flushes_published(service_fixture, ops, mocker: MockFixture):
+    def publish_twice(*args):
+        service_fixture.publish(" ".join(args))
+        service_fixture.publish("second")
+
+    mocker.patch.object(service_fixture, "_processors", {"pub": publish_twice})
+    write_spy = mocker.spy(ops, "write")
+    service_fixture.process_one("pub first message")
+    assert ops.getvalue() == "first message\nsecond\n"
+    assert write_spy.call_count == 1
+    service_fixture.process_one("unknown")
+    assert write_spy.call_count == 1
+
+
+def test_process_one_refreshes_log_levels(service_fixture, string_logger, log_stream, mocker: MockFixture):
+    assert service_fixture._debug_enabled and service_fixture._info_enabled
+    string_logger.logger.setLevel(logging.WARNING)
+    mocker.patch.object(service_fixture, "_processors", {"noop": lambda: None})
+    service_fixture.process_one("noop")
+    assert not service_fixture._debug_enabled and not service_fixture._info_enabled
+    assert log_stream.getvalue() == ""
 
 
 def test_publish(service_fixture, ops, log_stream):
     service_fixture.publish("test message")
+    assert ops.getvalue() == ""
+    service_fixture._flush()
+    assert ops.getvalue() == "test message\n"
+    service_fixture._flush()
     assert ops.getvalue() == "test message\n"
 
 
@@ -116,6 +169,42 @@ def test_get_market_notification(
                                      'target_currency="CUR2" target_rate="10.0" target_value="200.0"\n')
 
 
+def test_get_market_notification_reuses_price_texts(
+        securities_fixture, subscriptions_fixture, service_fixture, mocker: MockFixture
+):
+    mocker.patch.object(service_fixture, "_securities", securities_fixture)
+    mocker.patch("market_data_system.core.MarketDataService.get_price").return_value = 10.0
+    converter_patch = mocker.patch("market_data_system.core.convert_currency")
+    converter_patch.return_value = 200.0
+    other_user_sub = Subscription("other", "SYM", "CUR2")
+
+    price_texts = {}
+    assert service_fixture.get_market_notification(subscriptions_fixture["user SYM CUR2"], price_texts) == \
+           "user SYM CUR2 200.00"
+    assert service_fixture.get_market_notification(other_user_sub, price_texts) == "other SYM CUR2 200.00"
+    assert service_fixture.get_market_notification(subscriptions_fixture["user SYM CUR1"], price_texts) == \
+           "user SYM CUR1 123.00"
+    assert service_fixture.get_market_notification(subscriptions_fixture["user NOP CUR1"], price_texts) == \
+           "user NOP CUR1"
+    assert converter_patch.call_count == 1
+    assert price_texts == {("SYM", "CUR2"): " 200.00", ("SYM", "CUR1"): " 123.00", ("NOP", "CUR1"): ""}
+
+
+def test_get_market_notification_reuses_rates(securities_fixture, service_fixture, mocker: MockFixture):
+    securities_fixture["CUR1"] = Security("CUR1", "USD", 2.0)
+    securities_fixture["CUR2"] = Security("CUR2", "USD", 4.0)
+    mocker.patch.object(service_fixture, "_securities", securities_fixture)
+    get_price_spy = mocker.spy(service_fixture, "get_price")
+
+    rates = {}
+    assert service_fixture.get_market_notification(Subscription("user", "SYM", "CUR2"), rates=rates) == \
+           "user SYM CUR2 61.50"
+    assert service_fixture.get_market_notification(Subscription("user", "BOL", "CUR1"), rates=rates) == \
+           "user BOL CUR1 246.00"
+    assert rates == {"CUR1": 2.0, "CUR2": 4.0}
+    assert get_price_spy.call_count == 2
+
+
 def test_on_tick(securities_fixture, subscriptions_fixture, service_fixture, mocker: MockFixture):
     mocker.patch.object(service_fixture, "_securities", securities_fixture)
     with pytest.raises(ValueError) as e_info:
@@ -131,7 +220,9 @@ def test_on_tick(securities_fixture, subscriptions_fixture, service_fixture, moc
     assert securities_fixture["SYM"].price == 345.5
 
     mocker.patch.object(
-        service_fixture, "_subscriptions_by_topic", {"SYM": {subscriptions_fixture["user SYM CUR1"]: None}})
+        service_fixture,
+        "_subscriptions_by_topic",
+        {"SYM": topic_of(subscriptions_fixture["user SYM CUR1"])})
     service_fixture.on_tick("SYM", "456.50")
     assert securities_fixture["SYM"].price == 456.5
     assert mock_message_gen.call_count == 1
@@ -140,13 +231,59 @@ def test_on_tick(securities_fixture, subscriptions_fixture, service_fixture, moc
     mocker.patch.object(
         service_fixture,
         "_subscriptions_by_topic",
-        {"SYM": {subscriptions_fixture["user SYM CUR1"]: None, subscriptions_fixture["user SYM CUR2"]: None}})
+        {"SYM": topic_of(subscriptions_fixture["user SYM CUR1"], subscriptions_fixture["user SYM CUR2"])})
     service_fixture.on_tick("SYM", "1000.23")
     assert securities_fixture["SYM"].price == 1000.23
     assert mock_message_gen.call_count == 3
+    assert mock_message_gen.call_args[0][0] == subscriptions_fixture["user SYM CUR2"]
+    assert mock_message_gen.call_args[0][0].prefix == "user SYM CUR2"
     assert mock_publish.call_count == 3
 
 
+def test_get_market_notification_reuses_formatted_prices(securities_fixture, service_fixture, mocker: MockFixture):
+    securities_fixture["CUR1"] = Security("CUR1", "USD", 2.0)
+    securities_fixture["CUR2"] = Security("CUR2", "USD", 4.0)
+    mocker.patch.object(service_fixture, "_securities", securities_fixture)
+    converter_patch = mocker.patch("market_data_system.core.convert_currency", side_effect=convert_currency)
+    subscription = Subscription("user", "SYM", "CUR2")
+
+    assert service_fixture.get_market_notification(subscription) == "user SYM CUR2 61.50"
+    assert service_fixture.get_market_notification(Subscription("other", "SYM", "CUR2")) == "other SYM CUR2 61.50"
+    assert converter_patch.call_count == 1
+    securities_fixture["CUR2"].price = 2.0
+    assert service_fixture.get_market_notification(subscription) == "user SYM CUR2 123.00"
+    securities_fixture["SYM"].price = 0.0
+    assert service_fixture.get_market_notification(subscription) == "user SYM CUR2 0.00"
+    securities_fixture["SYM"].price = -0.0
+    assert service_fixture.get_market_notification(subscription) == "user SYM CUR2 -0.00"
+    assert converter_patch.call_count == 4
+
+
+def test_services_sharing_config(string_logger, mocker: MockFixture):
+    mocker.patch("market_data_system.core.get_configured_logger").return_value = string_logger
+    config = Config({"TSLA": Security("TSLA", "USD")}, {user: frozenset(["TSLA"]) for user in ("a", "b", "c")})
+    service_a = MarketDataService(config=config, in_stream=StringIO(""), out_stream=StringIO(""))
+    service_b = MarketDataService(config=config, in_stream=StringIO(""), out_stream=StringIO(""))
+
+    service_b.process_one("tick TSLA 100")
+    service_b.process_one("subscribe a TSLA")
+    service_a.process_one("tick TSLA 200")
+    service_b.process_one("subscribe b TSLA")
+    config.securities["TSLA"].price = 300.0
+    service_b.process_one("subscribe c TSLA")
+    assert service_b.out_stream.getvalue() == "a TSLA USD 100.00\nb TSLA USD 200.00\nc TSLA USD 300.00\n"
+
+
+def test_on_tick_batched(securities_fixture, service_fixture, ops, mocker: MockFixture):
+    mocker.patch.object(service_fixture, "_securities", securities_fixture)
+    mocker.patch.object(service_fixture, "_subscriptions_by_topic", {
+        "SYM": topic_of(*(Subscription(f"user{i}", "SYM", "CUR1") for i in range(3)))})
+    write_spy = mocker.spy(ops, "write")
+    service_fixture.process_one("tick SYM 10")
+    assert write_spy.call_count == 1
+    assert ops.getvalue() == "user0 SYM CUR1 10.00\nuser1 SYM CUR1 10.00\nuser2 SYM CUR1 10.00\n"
+
+
 def test_on_subscribe(securities_fixture, subscriptions_fixture, service_fixture, mocker: MockFixture):
     mock_publish = mocker.patch("market_data_system.core.MarketDataService.publish")
     mock_publish.return_value = None
@@ -159,39 +296,54 @@ def test_on_subscribe(securities_fixture, subscriptions_fixture, service_fixture
     assert mock_publish.call_args[0][0] == "User user is not entitled to SYM"
 
     mocker.patch.object(service_fixture, "_securities", securities_fixture)
-    mocker.patch.object(service_fixture, "_entitlements", {"user": ["SYM", "CUR2"]})
+    mocker.patch.object(service_fixture, "_entitlements", {"user": frozenset(["SYM", "CUR2"])})
     service_fixture.on_subscribe("user", "SYM", "CUR3")
     assert mock_publish.call_count == 2
     assert mock_publish.call_args[0][0] == "User user is not entitled to CUR3"
 
-    mocker.patch.object(service_fixture, "_active_subscriptions", {subscriptions_fixture["user SYM CUR1"]})
+    mocker.patch.object(service_fixture, "_active_subscriptions", {
+        ("user", "SYM", "CUR1"): subscriptions_fixture["user SYM CUR1"]})
     service_fixture.on_subscribe("user", "SYM")
     assert mock_publish.call_count == 3
     assert mock_publish.call_args[0][0] == "Subscription already exists"
 
-    active_subs = set()
-    subs_by_topic = defaultdict(dict)
+    active_subs = {}
+    subs_by_topic = {}
     mocker.patch.object(service_fixture, "_active_subscriptions", active_subs)
     mocker.patch.object(service_fixture, "_subscriptions_by_topic", subs_by_topic)
 
     service_fixture.on_subscribe("user", "SYM", "CUR1")
-    assert subscriptions_fixture["user SYM CUR1"] in active_subs
-    assert subscriptions_fixture["user SYM CUR1"] in subs_by_topic["SYM"]
+    assert active_subs[("user", "SYM", "CUR1")] == subscriptions_fixture["user SYM CUR1"]
+    assert subs_by_topic["SYM"] == topic_of(subscriptions_fixture["user SYM CUR1"])
+    assert mock_message_gen.call_args[1]["subscription"].prefix == "user SYM CUR1"
     assert mock_publish.call_count == 4
     assert mock_publish.call_args[0][0] == "price notification"
 
     service_fixture.on_subscribe("user", "SYM", "CUR2")
-    assert subscriptions_fixture["user SYM CUR2"] in active_subs
-    assert subscriptions_fixture["user SYM CUR2"] in subs_by_topic["SYM"]
-    assert subscriptions_fixture["user SYM CUR2"] in subs_by_topic["CUR2"]
-    assert subscriptions_fixture["user SYM CUR2"] in subs_by_topic["CUR1"]
+    assert active_subs[("user", "SYM", "CUR2")] == subscriptions_fixture["user SYM CUR2"]
+    assert subs_by_topic["SYM"] == topic_of(
+        subscriptions_fixture["user SYM CUR1"], subscriptions_fixture["user SYM CUR2"])
+    assert subs_by_topic["CUR2"] == topic_of(subscriptions_fixture["user SYM CUR2"])
+    assert subs_by_topic["CUR1"] == topic_of(subscriptions_fixture["user SYM CUR2"])
     assert mock_publish.call_count == 5
     assert mock_publish.call_args[0][0] == "price notification"
 
+    securities_fixture["CUR2"] = Security("CUR2", "USD", 1.5)
+    mocker.patch.object(service_fixture, "_entitlements", {"user": frozenset(["CUR2"])})
+    service_fixture.on_subscribe("user", "CUR2", "CUR2")
+    assert subs_by_topic["CUR2"] == topic_of(
+        subscriptions_fixture["user SYM CUR2"], Subscription("user", "CUR2", "CUR2"))
+    assert subs_by_topic["USD"] == topic_of(Subscription("user", "CUR2", "CUR2"))
+    assert service_fixture._topics_by_subscription == {
+        subscriptions_fixture["user SYM CUR1"]: ["SYM"],
+        subscriptions_fixture["user SYM CUR2"]: ["SYM", "CUR2", "CUR1"],
+        Subscription("user", "CUR2", "CUR2"): ["CUR2", "USD"]
+    }
+
 
 def test_on_unsubscribe(securities_fixture, subscriptions_fixture, service_fixture, mocker: MockFixture):
-    active_subs = set()
-    subs_by_topic = defaultdict(dict)
+    active_subs = {}
+    subs_by_topic = {}
     mocker.patch.object(service_fixture, "_active_subscriptions", active_subs)
     mocker.patch.object(service_fixture, "_subscriptions_by_topic", subs_by_topic)
     mocker.patch.object(service_fixture, "_securities", securities_fixture)
@@ -202,20 +354,21 @@ def test_on_unsubscribe(securities_fixture, subscriptions_fixture, service_fixtu
     assert mock_publish.call_count == 1
     assert mock_publish.call_args[0][0] == "Subscription does not exist"
 
-    active_subs.add(subscriptions_fixture["user SYM CUR1"])
-    active_subs.add(subscriptions_fixture["user SYM CUR2"])
-    subs_by_topic["SYM"] = {subscriptions_fixture["user SYM CUR1"]: None, subscriptions_fixture["user SYM CUR2"]: None}
-    subs_by_topic["CUR2"] = {subscriptions_fixture["user SYM CUR2"]: None}
-    subs_by_topic["CUR1"] = {subscriptions_fixture["user SYM CUR2"]: None}
+    active_subs[("user", "SYM", "CUR1")] = subscriptions_fixture["user SYM CUR1"]
+    active_subs[("user", "SYM", "CUR2")] = subscriptions_fixture["user SYM CUR2"]
+    subs_by_topic["SYM"] = topic_of(subscriptions_fixture["user SYM CUR1"], subscriptions_fixture["user SYM CUR2"])
+    subs_by_topic["CUR2"] = topic_of(subscriptions_fixture["user SYM CUR2"])
+    subs_by_topic["CUR1"] = topic_of(subscriptions_fixture["user SYM CUR2"])
+    topics_by_sub = {subscriptions_fixture["user SYM CUR1"]: ["SYM"],
+                     subscriptions_fixture["user SYM CUR2"]: ["SYM", "CUR2", "CUR1"]}
+    mocker.patch.object(service_fixture, "_topics_by_subscription", topics_by_sub)
 
     service_fixture.on_unsubscribe("user", "SYM")
-    assert subscriptions_fixture["user SYM CUR1"] not in subs_by_topic["SYM"]
-    assert subscriptions_fixture["user SYM CUR1"] not in active_subs
+    assert subs_by_topic["SYM"] == topic_of(subscriptions_fixture["user SYM CUR2"])
+    assert ("user", "SYM", "CUR1") not in active_subs
 
     service_fixture.on_unsubscribe("user", "SYM", "CUR2")
-    assert subscriptions_fixture["user SYM CUR2"] not in active_subs
+    assert ("user", "SYM", "CUR2") not in active_subs
     assert len(active_subs) == 0
     assert len(subs_by_topic) == 0
-    assert subscriptions_fixture["user SYM CUR2"] not in subs_by_topic.get("SYM", {})
-    assert subscriptions_fixture["user SYM CUR2"] not in subs_by_topic.get("CUR1", {})
-    assert subscriptions_fixture["user SYM CUR2"] not in subs_by_topic.get("CUR2", {})
+    assert len(topics_by_sub) == 0
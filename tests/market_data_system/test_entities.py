@@ -1,9 +1,13 @@
+import copy
+import pickle
+import sys
+import time
 import typing
 from dataclasses import FrozenInstanceError
 
 import pytest
 
-from market_data_system.entities import Security, Subscription
+from market_data_system.entities import Security, Subscription, TopicSubscriptions
 
 
 def test_subscription_hashable():
@@ -14,6 +18,38 @@ def test_subscription_hashable():
     assert hash(obj1) == hash(obj2)
 
 
+def test_subscription_hash_cached():
+    obj = Subscription("user", "SYM", "CUR")
+    assert hash(obj) == hash(("user", "SYM", "CUR"))
+    with pytest.raises(FrozenInstanceError) as e_info:
+        obj.__setattr__("_hash", 0)
+    assert e_info.value.args[0] == "cannot assign to field '_hash'"
+    with pytest.raises(FrozenInstanceError):
+        del obj.user
+    assert hash(obj) == hash(("user", "SYM", "CUR"))
+
+
+def test_subscription_copy_and_pickle():
+    obj = Subscription("user", "SYM", "CUR")
+    for clone in (copy.copy(obj), copy.deepcopy(obj), pickle.loads(pickle.dumps(obj))):
+        assert clone == obj
+        assert hash(clone) == hash(obj)
+        assert clone.prefix == "user SYM CUR"
+        assert clone.symbol is sys.intern("SYM")
+
+
+def test_subscription_interned_slots():
+    obj1 = Subscription("".join(["us", "er"]), "".join(["S", "YM"]), "".join(["C", "UR"]))
+    assert obj1.user is sys.intern("user")
+    assert obj1.symbol is sys.intern("SYM")
+    assert obj1.currency is sys.intern("CUR")
+    assert not hasattr(obj1, "__dict__")
+    assert obj1 != Subscription("user", "SYM", "CUR2")
+    assert obj1 != ("user", "SYM", "CUR")
+    assert repr(obj1) == "Subscription(user='user', symbol='SYM', currency='CUR')"
+    assert obj1.prefix == "user SYM CUR"
+
+
 def test_subscription_immutable():
     obj = Subscription("user", "SYM", "CUR")
     with pytest.raises(FrozenInstanceError) as e_info1:
@@ -35,3 +71,37 @@ def test_security_mutable_unhashable():
     assert obj1.price == 100.0
     obj2 = Security("SYM", "CUR", 200)
     assert obj1 != obj2
+    assert obj2 == Security("SYM", "CUR", 200)
+    assert not hasattr(obj1, "__dict__")
+
+
+def test_topic_subscriptions_ordered():
+    subs = [Subscription(f"user{i}", "SYM", "CUR") for i in range(4)]
+    topic = TopicSubscriptions()
+    assert not topic
+    for sub in subs:
+        topic.add(sub)
+    topic.add(subs[0])
+    assert len(topic) == 4
+    assert subs[1] in topic
+
+    topic.remove(subs[1])
+    topic.remove(subs[1])
+    assert subs[1] not in topic
+    assert list(topic.subscriptions) == [subs[0], subs[2], subs[3]]
+
+    topic.add(subs[1])
+    assert list(topic.subscriptions) == [subs[0], subs[2], subs[3], subs[1]]
+
+
+def test_topic_subscriptions_unsubscribe_churn():
+    subs = [Subscription(f"user{i}", "SYM", "CUR") for i in range(20000)]
+    topic = TopicSubscriptions()
+    started = time.perf_counter()
+    for sub in subs:
+        topic.add(sub)
+    for sub in subs:
+        topic.remove(sub)
+    # constant time removal takes milliseconds here, while renumbering the rest on every removal takes many seconds
+    assert time.perf_counter() - started < 2.0
+    assert not topic
@@ -1,5 +1,6 @@
 import json
-from io import StringIO
+import sys
+from io import BytesIO, StringIO
 
 import pytest
 from pytest_mock import MockFixture
@@ -18,7 +19,8 @@ from market_data_system.helpers import convert_currency, get_configured_logger,
         (3.0, 10.0, 333.33333, 100.00, 3),
         (None, 3.0, 100.0, None, 3),
         (3.0, 3.0, None, None, 3),
-        (3.0, None, 2.0, None, 3)
+        (3.0, None, 2.0, None, 3),
+        (10.0, 3.0, 100.0, 1000.0 / 3.0, None)
     ]
 )
 def test_currency_conversion(source_rate, target_rate, source_value, target_value, precision):
@@ -86,7 +88,22 @@ def test_load_service_config(service_config, mocker: MockFixture):
     actual = load_market_data_system_config("anypath")
     assert isinstance(actual, Config)
     assert actual.base_currency == "USD"
+    assert actual == (actual.securities, actual.entitlements, "USD")
     assert actual.entitlements == {k: set(v) for k, v in service_config["users"].items()}
+    assert all(isinstance(symbols, frozenset) for symbols in actual.entitlements.values())
+    assert actual.securities == {k: Security(k, v["currency"]) for k, v in service_config["symbols"].items()}
+    assert actual.securities["TSLA"].symbol is sys.intern("TSLA")
+    assert actual.securities["BMW"].currency is sys.intern("EUR")
+    assert next(s for s in actual.entitlements["elon.musk"] if s == "TSLA") is sys.intern("TSLA")
+    assert next(u for u in actual.entitlements if u == "elon.musk") is sys.intern("elon.musk")
+
+
+def test_load_service_config_with_orjson(service_config, mocker: MockFixture):
+    mocker.patch("builtins.open").return_value = BytesIO(json.dumps(service_config).encode("utf-8"))
+    orjson_patch = mocker.patch("market_data_system.helpers.orjson")
+    orjson_patch.loads.side_effect = json.loads
+    actual = load_market_data_system_config("anypath")
+    assert orjson_patch.loads.call_count == 1
     assert actual.securities == {k: Security(k, v["currency"]) for k, v in service_config["symbols"].items()}
 
 
@@ -111,3 +128,26 @@ def test_get_configured_logger_success(log_config, mocker: MockFixture):
     assert config_patch.call_args[0][0] == log_config
     assert isinstance(actual, KeyValContextLogger)
     assert actual.logger is logger_patch.return_value
+
+
+def test_get_configured_logger_cached(log_config, mocker: MockFixture):
+    log_config_text = json.dumps(log_config)
+    open_patch = mocker.patch("builtins.open")
+    open_patch.return_value = StringIO(log_config_text)
+    config_patch = mocker.patch("market_data_system.helpers.logging.config.dictConfig")
+    mocker.patch("market_data_system.helpers.logging.getLogger").return_value = mocker.MagicMock()
+
+    first = get_configured_logger("test", "any/path.json")
+    second = get_configured_logger("test", "any/path.json")
+    assert open_patch.call_count == 1
+    assert config_patch.call_count == 1
+    # adapters carry per-caller context (e.g. correlation id), so they are not shared even though config is cached
+    assert first is not second
+    assert first.logger is second.logger
+
+    open_patch.return_value = StringIO(log_config_text)
+    get_configured_logger("test", "other/path.json")
+    open_patch.return_value = StringIO(log_config_text)
+    get_configured_logger("test", "any/path.json")
+    assert open_patch.call_count == 3
+    assert config_patch.call_count == 3